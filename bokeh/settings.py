@@ -178,6 +178,30 @@ def convert_bool(value):
 
     raise ValueError("Cannot convert {} to boolean value".format(value))
 
+def convert_int(value):
+    ''' Convert a string to an integer
+
+    If an integer is passed in, it is returned as-is.
+
+    Args:
+        value (str) :
+            A string to convert to an integer
+
+    Returns:
+        int
+
+    Raises:
+        ValueError
+
+    '''
+    if isinstance(value, int):
+        return value
+
+    try:
+        return int(value)
+    except Exception:
+        raise ValueError("Cannot convert {} to integer value".format(value))
+
 def convert_str_seq(value):
     ''' Convert a string to a lit of strings
 
@@ -399,6 +423,7 @@ class PrioritizedSetting(object):
     def convert_type(self):
         if self._convert is convert_str: return "String"
         if self._convert is convert_bool: return "Bool"
+        if self._convert is convert_int: return "Int"
         if self._convert is convert_logging: return "Log Level"
         if self._convert is convert_str_seq: return "List[String]"
 
@@ -581,6 +606,23 @@ class Settings(object):
     A long, cryptographically-random secret unique to a Bokeh deployment.
     """)
 
+    session_id_entropy_bits = PrioritizedSetting("session_id_entropy_bits", "BOKEH_SESSION_ID_ENTROPY_BITS", default=128, convert=convert_int, help="""
+    How many bits of randomness session IDs should contain.
+
+    The default of 128 bits produces 22 character session IDs with 16 byte
+    signatures. Set to 261 for the longer 44 character session IDs with full
+    32 byte signatures used by previous versions of Bokeh. Values below 128 are
+    not allowed.
+    """)
+
+    session_mac = PrioritizedSetting("session_mac", "BOKEH_SESSION_MAC", default="hmac-sha256", help="""
+    The algorithm used to sign session IDs, either ``"hmac-sha256"`` or
+    ``"blake2b"`` (keyed BLAKE2b).
+
+    Session IDs signed with one algorithm will not validate with the other, so
+    all processes generating and checking session IDs must use the same value.
+    """)
+
     sign_sessions = PrioritizedSetting("sign_sessions", "BOKEH_SIGN_SESSIONS", default=False, help="""
     Whether the Boeh server should only allow sessions signed with a secret key.
 
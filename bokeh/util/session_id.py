@@ -12,23 +12,19 @@ other sessions hosted by the server.
 
 '''
 
-#-----------------------------------------------------------------------------
-# Boilerplate
-#-----------------------------------------------------------------------------
-import logging # isort:skip
-log = logging.getLogger(__name__)
-
 #-----------------------------------------------------------------------------
 # Imports
 #-----------------------------------------------------------------------------
 
 # Standard library imports
 import base64
-import codecs
 import hashlib
 import hmac
-import time
-from typing import Any, Optional, Tuple, Union
+import math
+import os
+import secrets
+from functools import lru_cache
+from typing import Optional, Union
 
 # Bokeh imports
 from bokeh.settings import settings
@@ -43,6 +39,48 @@ __all__ = (
     'generate_session_id',
 )
 
+# The secret key and signing flag can not change once the process has started,
+# so they are looked up (and the key encoded) only once, at import time.
+_SECRET_KEY_BYTES = settings.secret_key_bytes()
+
+_SIGN_SESSIONS = settings.sign_sessions()
+
+_SESSION_MAC = settings.session_mac()
+
+_SESSION_MACS = ('hmac-sha256', 'blake2b')
+
+_ALLOWED_CHARS = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+_SESSION_ID_ENTROPY_BITS = settings.session_id_entropy_bits()
+
+# number of _ALLOWED_CHARS needed for the configured entropy, e.g. 22 for 128 bits
+_SESSION_ID_LENGTH = math.ceil(_SESSION_ID_ENTROPY_BITS / math.log2(len(_ALLOWED_CHARS)))
+
+# number of random bytes needed for the configured entropy, e.g. 16 for 128 bits
+_SESSION_ID_BYTES = math.ceil(_SESSION_ID_ENTROPY_BITS / 8)
+
+# signatures are truncated to match the configured entropy, but are never
+# shorter than 16 bytes (128 bits) or longer than the full 32 byte digest
+_SIGNATURE_LENGTH = min(32, max(16, _SESSION_ID_BYTES))
+
+# session IDs from older versions were 44 characters signed with a full
+# 32 byte HMAC-SHA256 digest
+_LEGACY_SESSION_ID_LENGTH = 44
+
+_LEGACY_SIGNATURE_LENGTH = 32
+
+# no valid signed session ID is longer than this, in either the current or the
+# legacy form
+_MAX_SIGNED_SESSION_ID_LENGTH = max(
+    _SESSION_ID_LENGTH + 1 + math.ceil(_SIGNATURE_LENGTH * 4 / 3),
+    _LEGACY_SESSION_ID_LENGTH + 1 + math.ceil(_LEGACY_SIGNATURE_LENGTH * 4 / 3),
+)
+
+# bytes.translate() tables mapping the low six bits of a random byte onto
+# _ALLOWED_CHARS, and deleting the bytes that fall past the end of it
+_RANDOM_BYTE_TABLE = bytes(_ALLOWED_CHARS[b & 63] if (b & 63) < len(_ALLOWED_CHARS) else 0 for b in range(256))
+_RANDOM_BYTE_REJECT = bytes(b for b in range(256) if (b & 63) >= len(_ALLOWED_CHARS))
+
 #-----------------------------------------------------------------------------
 # General API
 #-----------------------------------------------------------------------------
@@ -55,8 +93,8 @@ def generate_secret_key() -> str:
     """
     return _get_random_string()
 
-def generate_session_id(secret_key: Optional[bytes] = settings.secret_key_bytes(),
-                        signed: bool = settings.sign_sessions()) -> str:
+def generate_session_id(secret_key: Optional[bytes] = None,
+                        signed: Optional[bool] = None) -> str:
     """Generate a random session ID.
     Typically, each browser tab connected to a Bokeh application
     has its own session ID.  In production deployments of a Bokeh
@@ -77,17 +115,20 @@ def generate_session_id(secret_key: Optional[bytes] = settings.secret_key_bytes(
                                   'BOKEH_SIGN_SESSIONS' env var)
 
     """
-    secret_key = _ensure_bytes(secret_key)
-    if signed:
-        # note: '-' can also be in the base64 encoded signature
-        base_id = _get_random_string(secret_key=secret_key)
-        return base_id + '-' + _signature(base_id, secret_key)
-    else:
-        return _get_random_string(secret_key=secret_key)
+    if signed is None:
+        signed = _SIGN_SESSIONS
+    if not signed:
+        # unsigned session IDs are not split, so may use the full base64 alphabet
+        return secrets.token_urlsafe(_SESSION_ID_BYTES)
+    secret_key = _SECRET_KEY_BYTES if secret_key is None else _ensure_bytes(secret_key)
+    base_id = _get_random_string(_SESSION_ID_LENGTH)
+    signature = _base64_encode(_signature(base_id, secret_key))
+    # '.' is not in the base64url alphabet, so it always separates the signature
+    return f"{base_id}.{signature}"
 
 def check_session_id_signature(session_id: str,
-                               secret_key: Optional[bytes] = settings.secret_key_bytes(),
-                               signed: Optional[bool] = settings.sign_sessions()) -> bool:
+                               secret_key: Optional[bytes] = None,
+                               signed: Optional[bool] = None) -> bool:
     """Check the signature of a session ID, returning True if it's valid.
 
     The server uses this function to check whether a session ID
@@ -101,18 +142,20 @@ def check_session_id_signature(session_id: str,
                                   'BOKEH_SIGN_SESSIONS' env var)
 
     """
-    secret_key = _ensure_bytes(secret_key)
-    if signed:
-        pieces = session_id.split('-', 1)
-        if len(pieces) != 2:
-            return False
-        base_id = pieces[0]
-        provided_signature = pieces[1]
-        expected_signature = _signature(base_id, secret_key)
-        # hmac.compare_digest() uses a string compare algorithm that doesn't
-        # short-circuit so we don't allow timing analysis
-        return hmac.compare_digest(expected_signature, provided_signature)
-    return True
+    if signed is None:
+        signed = _SIGN_SESSIONS
+    if not signed:
+        return True
+    # session IDs come straight from clients, reject oversized ones before they
+    # can take up space in the cache
+    if len(session_id) > _MAX_SIGNED_SESSION_ID_LENGTH:
+        return False
+    if secret_key is not None:
+        secret_key = _ensure_bytes(secret_key)
+        if secret_key != _SECRET_KEY_BYTES:
+            return _check_signature(session_id, secret_key)
+    # the default secret key never changes, so results for it can be cached
+    return _check_signature_cached(session_id)
 
 #-----------------------------------------------------------------------------
 # Dev API
@@ -122,26 +165,12 @@ def check_session_id_signature(session_id: str,
 # Private API
 #-----------------------------------------------------------------------------
 
-def _get_sysrandom() -> Tuple[Any, bool]:
-    # Use the system PRNG for session id generation (if possible)
-    # NOTE: secure random string generation implementation is adapted
-    #       from the Django project. Reference:
-    #       https://github.com/django/django/blob/0ed7d155635da9f79d4dd67e4889087d3673c6da/django/utils/crypto.py
-    import random
-    try:
-        sysrandom = random.SystemRandom()
-        using_sysrandom = True
-        return sysrandom, using_sysrandom
-    except NotImplementedError:
-        import warnings
-        warnings.warn('A secure pseudo-random number generator is not available '
-                      'on your system. Falling back to Mersenne Twister.')
-        if settings.secret_key() is None:
-            warnings.warn('A secure pseudo-random number generator is not available '
-                          'and no BOKEH_SECRET_KEY has been set. '
-                          'Setting a secret key will mitigate the lack of a secure generator.')
-        using_sysrandom = False
-        return random, using_sysrandom
+# hmac.digest() is only available on Python 3.7+
+if hasattr(hmac, 'digest'):
+    _hmac_digest = hmac.digest
+else:
+    def _hmac_digest(key: bytes, msg: bytes, digest: str) -> bytes: # type: ignore
+        return hmac.new(key, msg, digest).digest()
 
 def _ensure_bytes(secret_key: Union[str, bytes, None]) -> Optional[bytes]:
     if secret_key is None:
@@ -149,53 +178,92 @@ def _ensure_bytes(secret_key: Union[str, bytes, None]) -> Optional[bytes]:
     elif isinstance(secret_key, bytes):
         return secret_key
     else:
-        return codecs.encode(secret_key, 'utf-8')
-
-# this is broken out for unit testability
-def _reseed_if_needed(using_sysrandom: bool, secret_key: Optional[bytes]) -> None:
-    secret_key = _ensure_bytes(secret_key)
-    if not using_sysrandom:
-        # This is ugly, and a hack, but it makes things better than
-        # the alternative of predictability. This re-seeds the PRNG
-        # using a value that is hard for an attacker to predict, every
-        # time a random string is required. This may change the
-        # properties of the chosen random sequence slightly, but this
-        # is better than absolute predictability.
-        data = f"{random.getstate()}{time.time()}{secret_key!s}".encode('utf-8')
-        random.seed(hashlib.sha256(data).digest())
-
-def _base64_encode(decoded: Union[bytes, str]) -> str:
-    # base64 encode both takes and returns bytes, we want to work with strings.
-    # If 'decoded' isn't bytes already, assume it's utf-8
-    decoded_as_bytes = _ensure_bytes(decoded)
-    # TODO: urlsafe_b64encode only accepts bytes input, not Optional[bytes].
-    # Perhaps we can change _ensure_bytes change return type from Optional[bytes] to bytes
-    encoded = codecs.decode(base64.urlsafe_b64encode(decoded_as_bytes), 'ascii')  # type: ignore
+        return secret_key.encode('utf-8')
+
+def _base64_encode(decoded: bytes) -> str:
     # remove padding '=' chars that cause trouble
-    return str(encoded.rstrip('='))
-
-def _signature(base_id: str, secret_key: Optional[bytes]) -> str:
-    secret_key = _ensure_bytes(secret_key)
-    base_id_encoded = codecs.encode(base_id, "utf-8")
-    signer = hmac.new(secret_key, base_id_encoded, hashlib.sha256)  # type: ignore
-    return _base64_encode(signer.digest())
-
-def _get_random_string(length: int = 44,
-                       allowed_chars: str = 'abcdefghijklmnopqrstuvwxyz'
-                       'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789',
-                       secret_key: Optional[bytes] = settings.secret_key_bytes()) -> str:
+    return base64.urlsafe_b64encode(decoded).rstrip(b'=').decode('ascii')
+
+def _new_signer(secret_key: bytes) -> Union[hmac.HMAC, hashlib.blake2b]:
+    if _SESSION_MAC == 'blake2b':
+        # BLAKE2b keys are limited in size, hash longer keys down the way HMAC does
+        if len(secret_key) > hashlib.blake2b.MAX_KEY_SIZE:
+            secret_key = hashlib.blake2b(secret_key).digest()
+        return hashlib.blake2b(key=secret_key, digest_size=32)
+    return hmac.new(secret_key, digestmod=hashlib.sha256)
+
+def _signature(base_id: str, secret_key: Optional[bytes]) -> bytes:
+    if secret_key is _SECRET_KEY_BYTES and _SIGNER_TEMPLATE is not None:
+        signer = _SIGNER_TEMPLATE.copy()
+    elif _SESSION_MAC == 'hmac-sha256':
+        return _hmac_digest(secret_key, base_id.encode('utf-8'), 'sha256')[:_SIGNATURE_LENGTH]  # type: ignore
+    else:
+        signer = _new_signer(secret_key)  # type: ignore
+    signer.update(base_id.encode('utf-8'))
+    return signer.digest()[:_SIGNATURE_LENGTH]
+
+def _check_signature(session_id: str, secret_key: Optional[bytes]) -> bool:
+    base_id, sep, provided_signature = session_id.rpartition('.')
+    if sep:
+        signature_length = _SIGNATURE_LENGTH
+    else:
+        # session IDs from older versions are separated with '-', which base IDs
+        # never contain but signatures may, so split on the first one
+        base_id, sep, provided_signature = session_id.partition('-')
+        if not sep or len(base_id) != _LEGACY_SESSION_ID_LENGTH:
+            return False
+        signature_length = _LEGACY_SIGNATURE_LENGTH
+    # only accept the exact encoding generate_session_id produces, so that each
+    # signed session ID has a single valid string form
+    if len(provided_signature) != math.ceil(signature_length * 4 / 3):
+        return False
+    try:
+        # put back the '=' padding that was stripped when generating
+        padded = provided_signature + '=' * (-len(provided_signature) % 4)
+        provided_digest = base64.b64decode(padded, altchars=b'-_', validate=True)
+    except ValueError:
+        return False
+    # rejects unused trailing bits that are set, as well as '+' and '/'
+    if _base64_encode(provided_digest) != provided_signature:
+        return False
+    if sep == '.':
+        expected_digest = _signature(base_id, secret_key)
+    else:
+        # older versions always signed with full length HMAC-SHA256 digests
+        expected_digest = _hmac_digest(secret_key, base_id.encode('utf-8'), 'sha256')  # type: ignore
+    # hmac.compare_digest() uses a compare algorithm that doesn't
+    # short-circuit so we don't allow timing analysis
+    return hmac.compare_digest(expected_digest, provided_digest)
+
+@lru_cache(maxsize=4096)
+def _check_signature_cached(session_id: str) -> bool:
+    return _check_signature(session_id, _SECRET_KEY_BYTES)
+
+def _get_random_string(length: int = 44) -> str:
     """
     Return a securely generated random string.
     With the a-z, A-Z, 0-9 character set:
     Length 12 is a 71-bit value. log_2((26+26+10)^12) =~ 71
     Length 44 is a 261-bit value. log_2((26+26+10)^44) = 261
     """
-    secret_key = _ensure_bytes(secret_key)
-    _reseed_if_needed(using_sysrandom, secret_key)
-    return ''.join(random.choice(allowed_chars) for i in range(length))
+    # Draw random bytes in batches and keep the low six bits of each byte,
+    # rejecting values past the end of the 62 character alphabet so that
+    # every character is equally likely.
+    chars = b''
+    while len(chars) < length:
+        chars += os.urandom(64).translate(_RANDOM_BYTE_TABLE, _RANDOM_BYTE_REJECT)
+    return chars[:length].decode('ascii')
 
 #-----------------------------------------------------------------------------
 # Code
 #-----------------------------------------------------------------------------
 
-random, using_sysrandom = _get_sysrandom()
+if _SESSION_MAC not in _SESSION_MACS:
+    raise ValueError(f"Unknown session MAC {_SESSION_MAC!r}, valid values are: {', '.join(_SESSION_MACS)}")
+
+if _SESSION_ID_ENTROPY_BITS < 128:
+    raise ValueError(f"Session ID entropy of {_SESSION_ID_ENTROPY_BITS} bits is too low, at least 128 bits are required")
+
+# signer keyed with the default secret key, copied for each signature to
+# avoid redoing the key setup every time
+_SIGNER_TEMPLATE: Optional[Union[hmac.HMAC, hashlib.blake2b]] = None if _SECRET_KEY_BYTES is None else _new_signer(_SECRET_KEY_BYTES)
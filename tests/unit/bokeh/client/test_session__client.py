@@ -17,6 +17,9 @@ import pytest ; pytest
 # External imports
 from mock import patch
 
+# Bokeh imports
+from bokeh.util.session_id import generate_session_id
+
 # Module under test
 import bokeh.client.session as bcs # isort:skip
 
@@ -42,7 +45,7 @@ class Test_ClientSession(object):
         assert s.document is None
         assert s._connection._arguments is None
         assert isinstance(s.id, str)
-        assert len(s.id) == 44
+        assert len(s.id) == len(generate_session_id())
 
     def test_creation_with_session_id(self) -> None:
         s = bcs.ClientSession("sid")
@@ -58,7 +61,7 @@ class Test_ClientSession(object):
         assert s._connection._arguments is None
         assert s._connection.url == "wsurl"
         assert isinstance(s.id, str)
-        assert len(s.id) == 44
+        assert len(s.id) == len(generate_session_id())
 
     def test_creation_with_ioloop(self) -> None:
         s = bcs.ClientSession(io_loop="io_loop")
@@ -67,14 +70,14 @@ class Test_ClientSession(object):
         assert s._connection._arguments is None
         assert s._connection.io_loop == "io_loop"
         assert isinstance(s.id, str)
-        assert len(s.id) == 44
+        assert len(s.id) == len(generate_session_id())
 
     def test_creation_with_arguments(self) -> None:
         s = bcs.ClientSession(arguments="args")
         assert s.connected == False
         assert s.document is None
         assert s._connection._arguments == "args"
-        assert len(s.id) == 44
+        assert len(s.id) == len(generate_session_id())
 
     @patch("bokeh.client.connection.ClientConnection.connect")
     def test_connect(self, mock_connect) -> None:
@@ -59,6 +59,8 @@ _expected_settings = (
     'resources',
     'rootdir',
     'secret_key',
+    'session_id_entropy_bits',
+    'session_mac',
     'sign_sessions',
     'simple_ids',
     'ssl_certfile',
@@ -93,6 +95,8 @@ class TestSettings(object):
         assert bs.settings.strict.convert_type == "Bool"
         assert bs.settings.xsrf_cookies.convert_type == "Bool"
 
+        assert bs.settings.session_id_entropy_bits.convert_type == "Int"
+
         assert bs.settings.py_log_level.convert_type == "Log Level"
 
         assert bs.settings.allowed_ws_origin.convert_type == "List[String]"
@@ -106,6 +110,7 @@ class TestSettings(object):
             'strict',
             'py_log_level',
             'allowed_ws_origin',
+            'session_id_entropy_bits',
             'xsrf_cookies',
         ])
         for name in default_typed:
@@ -133,6 +138,15 @@ class TestConverters(object):
         with pytest.raises(ValueError):
             bs.convert_bool("junk")
 
+    @pytest.mark.parametrize("value", ["0", "128", "-3", 261])
+    def test_convert_int(self, value) -> None:
+        assert bs.convert_int(value) == int(value)
+
+    @pytest.mark.parametrize("value", ["junk", "1.5", None])
+    def test_convert_int_bad(self, value) -> None:
+        with pytest.raises(ValueError):
+            bs.convert_int(value)
+
     @pytest.mark.parametrize("value", ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"])
     def test_convert_logging_good(self, value) -> None:
         assert bs.convert_logging(value) == getattr(logging, value)
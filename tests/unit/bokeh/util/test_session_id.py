@@ -17,17 +17,16 @@ import pytest ; pytest
 # Standard library imports
 import base64
 import codecs
+import hashlib
+import hmac
 import os
-import random
-
-# External imports
-from mock import patch
+import subprocess
+import sys
 
 # Bokeh imports
 from bokeh.util.session_id import (
-    _base64_encode,
-    _get_sysrandom,
-    _reseed_if_needed,
+    _check_signature_cached,
+    _get_random_string,
     _signature,
     check_session_id_signature,
     generate_secret_key,
@@ -43,6 +42,9 @@ import bokeh.util.session_id # isort:skip
 
 # decoder for our flavor of base64 that converts to ascii
 # and drops '=' padding
+def _base64_encode(decoded):
+    return codecs.decode(base64.urlsafe_b64encode(decoded), 'ascii').rstrip('=')
+
 def _base64_decode(encoded):
     # put the padding back
     mod = len(encoded) % 4
@@ -53,62 +55,77 @@ def _base64_decode(encoded):
     encoded_as_bytes = codecs.encode(encoded, 'ascii')
     return base64.urlsafe_b64decode(encoded_as_bytes)
 
-def _base64_decode_utf8(encoded):
-    return codecs.decode(_base64_decode(encoded), 'utf-8')
-
-def _nie():
-    def func():
-        raise NotImplementedError()
-    return func
-
-_MERSENNE_MSG = 'A secure pseudo-random number generator is not available on your system. Falling back to Mersenne Twister.'
-
 #-----------------------------------------------------------------------------
 # General API
 #-----------------------------------------------------------------------------
 
 class TestSessionId(object):
-    def test_base64_roundtrip(self) -> None:
-        for s in [ "", "a", "ab", "abc", "abcd", "abcde", "abcdef", "abcdefg",
-                   "abcdefgh", "abcdefghi",
-                   "abcdefghijklmnopqrstuvwxyz" ]:
-            assert s == _base64_decode_utf8(_base64_encode(s))
-
-    def test_reseed_if_needed(self) -> None:
-        # we have to set a seed in order to be able to get state
-        random.seed(codecs.encode("abcdefg", "utf-8"))
-        state = random.getstate()
-        _reseed_if_needed(using_sysrandom=True, secret_key=None)
-        # did NOT reseed
-        assert state == random.getstate()
-        # monkeypatch
-        saved = bokeh.util.session_id.random
-        try:
-            bokeh.util.session_id.random = random
-            _reseed_if_needed(using_sysrandom=False, secret_key="abc")
-            # DID reseed
-            assert state != random.getstate()
-        finally:
-            bokeh.util.session_id.random = saved
-
     def test_signature(self) -> None:
-        sig = _signature("xyz", secret_key="abc")
-        with_same_key = _signature("xyz", secret_key="abc")
+        sig = _signature("xyz", secret_key=b"abc")
+        with_same_key = _signature("xyz", secret_key=b"abc")
         assert sig == with_same_key
-        with_different_key = _signature("xyz", secret_key="qrs")
+        with_different_key = _signature("xyz", secret_key=b"qrs")
         assert sig != with_different_key
 
+    def test_signature_with_default_key(self, monkeypatch) -> None:
+        key = b"abc"
+        monkeypatch.setattr(bokeh.util.session_id, "_SECRET_KEY_BYTES", key)
+        monkeypatch.setattr(bokeh.util.session_id, "_SIGNER_TEMPLATE", hmac.new(key, digestmod=hashlib.sha256))
+        # a distinct but equal key object does not go through the template
+        assert _signature("xyz", secret_key=key) == _signature("xyz", secret_key="abc".encode('utf-8'))
+        assert _signature("xyz", secret_key=key) == _signature("xyz", secret_key=key)
+        assert _signature("xyz", secret_key=key) != _signature("xyzw", secret_key=key)
+
+    def test_signature_blake2b(self, monkeypatch) -> None:
+        monkeypatch.setattr(bokeh.util.session_id, "_SESSION_MAC", "blake2b")
+        sig = _signature("xyz", secret_key=b"abc")
+        assert sig == hashlib.blake2b(b"xyz", key=b"abc", digest_size=32).digest()[:16]
+        assert sig != hmac.new(b"abc", b"xyz", hashlib.sha256).digest()[:16]
+        assert _signature("xyz", secret_key=b"abc" * 30) != _signature("xyz", secret_key=b"abc" * 31)
+
+    def test_generate_signed_blake2b(self, monkeypatch) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        monkeypatch.setattr(bokeh.util.session_id, "_SESSION_MAC", "blake2b")
+        assert not check_session_id_signature(session_id, secret_key="abc", signed=True)
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        assert check_session_id_signature(session_id, secret_key="abc", signed=True)
+        assert not check_session_id_signature(session_id, secret_key="qrs", signed=True)
+
+    def test_signature_is_raw_digest(self) -> None:
+        sig = _signature("xyz", secret_key=b"abc")
+        assert isinstance(sig, bytes)
+        assert sig == hmac.new(b"abc", b"xyz", hashlib.sha256).digest()[:16]
+
+    def test_legacy_session_id_length(self, monkeypatch) -> None:
+        monkeypatch.setattr(bokeh.util.session_id, "_SESSION_ID_LENGTH", 44)
+        monkeypatch.setattr(bokeh.util.session_id, "_SESSION_ID_BYTES", 33)
+        monkeypatch.setattr(bokeh.util.session_id, "_SIGNATURE_LENGTH", 32)
+        assert 44 == len(generate_session_id(signed=False))
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        base_id, sig = session_id.split('.')
+        assert 44 == len(base_id)
+        assert 43 == len(sig)
+        assert check_session_id_signature(session_id, secret_key="abc", signed=True)
+        monkeypatch.setattr(bokeh.util.session_id, "_SIGNATURE_LENGTH", 16)
+        assert not check_session_id_signature(session_id, secret_key="abc", signed=True)
+
+    def test_signature_is_unpadded_base64(self) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        base_id, sig = session_id.split('.')
+        assert '=' not in sig
+        assert _base64_decode(sig) == _signature(base_id, secret_key=b"abc")
+
     def test_generate_unsigned(self) -> None:
         session_id = generate_session_id(signed=False)
-        assert 44 == len(session_id)
+        assert 22 == len(session_id)
         another_session_id = generate_session_id(signed=False)
-        assert 44 == len(another_session_id)
+        assert 22 == len(another_session_id)
 
         assert session_id != another_session_id
 
     def test_generate_signed(self) -> None:
         session_id = generate_session_id(signed=True, secret_key="abc")
-        assert '-' in session_id
+        assert '.' in session_id
         assert check_session_id_signature(session_id, secret_key="abc", signed=True)
         assert not check_session_id_signature(session_id, secret_key="qrs", signed=True)
 
@@ -122,6 +139,78 @@ class TestSessionId(object):
     def test_check_signature_of_junk_with_hyphen_in_it(self) -> None:
         assert not check_session_id_signature("foo-bar-baz", secret_key="abc", signed=True)
 
+    def test_check_signature_of_junk_with_dot_in_it(self) -> None:
+        assert not check_session_id_signature("foo.bar.baz", secret_key="abc", signed=True)
+
+    def test_check_signature_with_hyphen_in_signature(self) -> None:
+        base_id = next(base_id for base_id in map(str, range(1000)) if '-' in _base64_encode(_signature(base_id, b"abc")))
+        session_id = base_id + '.' + _base64_encode(_signature(base_id, b"abc"))
+        assert check_session_id_signature(session_id, secret_key="abc", signed=True)
+
+    def test_check_signature_with_legacy_separator(self) -> None:
+        # the format produced by older versions: 44 characters, '-', then a
+        # full HMAC-SHA256 signature
+        base_id = _get_random_string(44)
+        digest = hmac.new(b"abc", base_id.encode('utf-8'), hashlib.sha256).digest()
+        session_id = base_id + '-' + _base64_encode(digest)
+        assert len(session_id) == 88
+        assert check_session_id_signature(session_id, secret_key="abc", signed=True)
+        assert not check_session_id_signature(session_id, secret_key="qrs", signed=True)
+        assert not check_session_id_signature(session_id + "=", secret_key="abc", signed=True)
+        assert not check_session_id_signature(base_id + '-' + _base64_encode(digest[:16]), secret_key="abc", signed=True)
+        assert not check_session_id_signature(base_id[:22] + '-' + _base64_encode(digest), secret_key="abc", signed=True)
+
+    def test_check_signature_new_form_not_accepted_with_legacy_separator(self) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        assert not check_session_id_signature(session_id.replace('.', '-'), secret_key="abc", signed=True)
+
+    def test_check_signature_of_junk_signature(self) -> None:
+        assert not check_session_id_signature("foo-", secret_key="abc", signed=True)
+        assert not check_session_id_signature("foo-a", secret_key="abc", signed=True)
+        assert not check_session_id_signature("foo-\u00e9\u00e9\u00e9\u00e9", secret_key="abc", signed=True)
+
+    def test_check_signature_with_default_key_is_cached(self, monkeypatch) -> None:
+        key = b"abc"
+        monkeypatch.setattr(bokeh.util.session_id, "_SECRET_KEY_BYTES", key)
+        monkeypatch.setattr(bokeh.util.session_id, "_SIGNER_TEMPLATE", None)
+        _check_signature_cached.cache_clear()
+        try:
+            session_id = generate_session_id(signed=True, secret_key="abc")
+            assert check_session_id_signature(session_id, signed=True)
+            assert check_session_id_signature(session_id, secret_key="abc", signed=True)
+            assert not check_session_id_signature("foo.bar", signed=True)
+            assert not check_session_id_signature("foo.bar", signed=True)
+            assert _check_signature_cached.cache_info().hits == 2
+            assert _check_signature_cached.cache_info().misses == 2
+            assert not check_session_id_signature(session_id, secret_key="qrs", signed=True)
+            assert _check_signature_cached.cache_info().hits == 2
+            assert not check_session_id_signature(session_id + "x" * 100, signed=True)
+            assert _check_signature_cached.cache_info().currsize == 2
+        finally:
+            _check_signature_cached.cache_clear()
+
+    def test_check_signature_with_padding(self) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        assert not check_session_id_signature(session_id + "=", secret_key="abc", signed=True)
+        assert not check_session_id_signature(session_id + "==", secret_key="abc", signed=True)
+
+    def test_check_signature_with_junk_in_signature(self) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        base_id, sig = session_id.split('.')
+        for junk in ("!!!!", "====", "    ", "+/+/"):
+            assert not check_session_id_signature(base_id + '.' + sig[:4] + junk + sig[4:], secret_key="abc", signed=True)
+
+    def test_check_signature_with_trailing_bits(self) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+        accepted = [c for c in alphabet if check_session_id_signature(session_id[:-1] + c, secret_key="abc", signed=True)]
+        assert accepted == [session_id[-1]]
+
+    def test_check_signature_too_long(self) -> None:
+        session_id = generate_session_id(signed=True, secret_key="abc")
+        assert not check_session_id_signature(session_id + "." * 1000, secret_key="abc", signed=True)
+        assert not check_session_id_signature("x" * 1000 + session_id, secret_key="abc", signed=True)
+
     def test_check_signature_with_signing_disabled(self) -> None:
         assert check_session_id_signature("gobbledygook", secret_key="abc", signed=False)
 
@@ -138,6 +227,13 @@ class TestSessionId(object):
         assert check_session_id_signature(session_id, secret_key="abc", signed=True)
         assert check_session_id_signature(session_id, secret_key="abc", signed=True)
 
+    @pytest.mark.parametrize("bits", ["0", "-1", "127"])
+    def test_entropy_bits_too_low(self, bits) -> None:
+        env = dict(os.environ, BOKEH_SESSION_ID_ENTROPY_BITS=bits)
+        with pytest.raises(subprocess.CalledProcessError) as e:
+            subprocess.check_output([sys.executable, "-c", "import bokeh.util.session_id"], env=env, stderr=subprocess.STDOUT)
+        assert f"Session ID entropy of {bits} bits is too low, at least 128 bits are required" in e.value.output.decode('utf-8')
+
 #-----------------------------------------------------------------------------
 # Dev API
 #-----------------------------------------------------------------------------
@@ -146,41 +242,20 @@ class TestSessionId(object):
 # Private API
 #-----------------------------------------------------------------------------
 
-class Test__get_sysrandom(object):
+class Test__get_random_string(object):
 
-    def test_default(self) -> None:
-        import random
-        try:
-            random.SystemRandom()
-            expected = True
-        except NotImplementedError:
-            expected = False
-        _random, using_sysrandom = _get_sysrandom()
-        assert using_sysrandom == expected
-
-    @patch('random.SystemRandom', new_callable=_nie)
-    def test_missing_sysrandom_no_secret_key(self, _mock_sysrandom) -> None:
-        with pytest.warns(UserWarning) as warns:
-            random, using_sysrandom = _get_sysrandom()
-            assert not using_sysrandom
-            assert len(warns) == 2
-            assert warns[0].message.args[0] == _MERSENNE_MSG
-            assert warns[1].message.args[0] == (
-                'A secure pseudo-random number generator is not available '
-                'and no BOKEH_SECRET_KEY has been set. '
-                'Setting a secret key will mitigate the lack of a secure '
-                'generator.'
-            )
-
-    @patch('random.SystemRandom', new_callable=_nie)
-    def test_missing_sysrandom_with_secret_key(self, _mock_sysrandom) -> None:
-        os.environ["BOKEH_SECRET_KEY"] = "foo"
-        with pytest.warns(UserWarning) as warns:
-            random, using_sysrandom = _get_sysrandom()
-            assert not using_sysrandom
-            assert len(warns) == 1
-            assert warns[0].message.args[0] == _MERSENNE_MSG
-        del os.environ["BOKEH_SECRET_KEY"]
+    def test_default_length(self) -> None:
+        assert len(_get_random_string()) == 44
+
+    def test_length(self) -> None:
+        for length in (0, 1, 12, 100, 1000):
+            assert len(_get_random_string(length)) == length
+
+    def test_allowed_chars(self) -> None:
+        assert _get_random_string(1000).isalnum()
+
+    def test_uses_whole_alphabet(self) -> None:
+        assert len(set(_get_random_string(10000))) == 62
 
 #-----------------------------------------------------------------------------
 # Code